@@ -1,21 +1,787 @@
 import sys
 import asyncio
+import hmac
 import json
+import logging
 import os
 import platform
+import re
+import secrets
+import signal
+import sqlite3
 import subprocess
+import threading
 import time
+from contextlib import closing, contextmanager
+from http import HTTPStatus
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QLineEdit, QPushButton, QComboBox, QFrame, QStackedWidget,
-    QMessageBox, QInputDialog, QProgressBar
+    QMessageBox, QInputDialog, QProgressBar, QCheckBox
 )
-from PyQt6.QtCore import QThread, pyqtSignal, QObject, Qt
+from PyQt6.QtCore import QCoreApplication, QThread, QTimer, pyqtSignal, QObject, Qt
+from telethon import utils
 from telethon.sync import TelegramClient
-from telethon.tl.types import DocumentAttributeSticker, DocumentAttributeFilename
-from telethon.errors.rpcerrorlist import SessionPasswordNeededError
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.channels import GetParticipantsRequest
+from telethon.tl.functions.upload import GetFileRequest
+from telethon.tl.types import (
+    DocumentAttributeSticker, DocumentAttributeFilename, Channel, Chat,
+    ChannelParticipantsRecent, ChannelParticipantsAdmins, ChannelParticipantsBots, ChannelParticipantsSearch
+)
+from telethon.errors import RPCError, UnauthorizedError, AuthKeyError, AuthKeyNotFound
+from telethon.errors.rpcerrorlist import SessionPasswordNeededError, FileReferenceExpiredError
 
 CONFIG_FILE = "config.json"
+HISTORY_PAGE_SIZE = 100  # Telethon requests history in chunks of this size
+REPLY_FETCH_BATCH_SIZE = 100
+QUOTE_LENGTH = 80
+SESSION_FLUSH_INTERVAL = 30  # seconds between in-memory session flushes
+STATS_WORD_COUNTERS = 2000  # memory bound for the top words sketch
+STATS_TOP_WORDS = 50
+WORD_PATTERN = re.compile(r"\w{3,}")
+REDACTION_RULES_FILE = "redaction_rules.json"
+REDACTION_BATCH_SIZE = 1000
+# A phone number needs a '+' country code or the usual 3-3-4 grouping, so
+# dates, order numbers and numeric file names are left alone.
+PHONE_PATTERN = (r"(?<![\w+])(?:\+\d{1,3}[\s.-]?(?:\(\d{1,4}\)[\s.-]?)?\d{2,4}(?:[\s.-]?\d{2,4}){1,4}"
+                 r"|\(\d{3}\)\s?\d{3}[\s.-]\d{4}|\d{3}[\s.-]\d{3}[\s.-]\d{4})(?!\w)")
+EMAIL_PATTERN = r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"
+REDACTION_TOKEN_PATTERN = re.compile(r"\w+")
+REDACTION_SPLIT_PATTERN = re.compile(r"(\w+)")
+LEADING_FLAGS_PATTERN = re.compile(r"\(\?([aiLmsux]+)\)")
+PARTICIPANT_CONCURRENCY = 4
+PARTICIPANT_SEARCH_PREFIXES = "abcdefghijklmnopqrstuvwxyz0123456789"
+PARTICIPANT_MAX_PREFIX_LENGTH = 3  # how deep capped search prefixes are refined
+PARTICIPANT_MAX_SEARCHES = 400  # search queries allowed per export, however many prefixes are capped
+PARTICIPANT_PAGE_SIZE = 200  # the most members the server returns per request
+PARTICIPANT_FILTERS = (ChannelParticipantsRecent, ChannelParticipantsAdmins, ChannelParticipantsBots)
+LARGE_MEDIA_THRESHOLD = 20 * 1024 * 1024  # files above this use the parallel download path
+MEDIA_PART_SIZE = 512 * 1024  # largest part size upload.getFile accepts
+MEDIA_DOWNLOAD_CONNECTIONS = 4
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_JOB_HISTORY = 100  # finished jobs kept for status queries
+SERVICE_MAX_BODY = 64 * 1024  # request bodies are small JSON objects
+COMMENT_CONCURRENCY = 8  # comment threads fetched at the same time
+
+
+class ExportTracer:
+    """
+    Collects timed spans, counters and histograms for one export.
+    Everything is kept in memory and only written out at the end, so
+    tracing is cheap enough to leave on for every export.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.counters = {}
+        self.histograms = {}
+
+    def now_us(self):
+        return (time.perf_counter() - self.origin) * 1_000_000
+
+    @contextmanager
+    def span(self, name, **args):
+        """Times the enclosed block as a complete trace event."""
+        start = self.now_us()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, self.now_us() - start, **args)
+
+    def add_span(self, name, start_us, duration_us, **args):
+        self.events.append({
+            "name": name, "ph": "X", "ts": start_us, "dur": duration_us,
+            "pid": os.getpid(), "tid": threading.get_ident(), "args": args
+        })
+        self.observe(f"{name}_ms", duration_us / 1000)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Records a value into a histogram with power-of-two buckets."""
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = {"count": 0, "sum": 0.0, "min": value, "max": value, "buckets": {}}
+        hist["count"] += 1
+        hist["sum"] += value
+        hist["min"] = min(hist["min"], value)
+        hist["max"] = max(hist["max"], value)
+        bucket = 0
+        while bucket < value:
+            bucket = bucket * 2 if bucket else 1
+        hist["buckets"][bucket] = hist["buckets"].get(bucket, 0) + 1
+
+    def summary(self):
+        histograms = {}
+        for name, hist in self.histograms.items():
+            histograms[name] = dict(hist, mean=hist["sum"] / hist["count"],
+                                    buckets={f"le_{k}": v for k, v in sorted(hist["buckets"].items())})
+        return {"counters": self.counters, "histograms": histograms}
+
+    def phase_totals(self):
+        """Returns total seconds spent in each top-level phase."""
+        totals = {}
+        for event in self.events:
+            if event["name"] != "history_page":
+                totals[event["name"]] = totals.get(event["name"], 0) + event["dur"] / 1_000_000
+        return totals
+
+    def write(self, base_path):
+        """Writes '<base>.trace.json' (Chrome trace format) and '<base>.metrics.json'."""
+        with open(f"{base_path}.trace.json", 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        with open(f"{base_path}.metrics.json", 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=4)
+
+
+class SessionWriteTimer:
+    """
+    Mixin that measures how long a session spends storing entities,
+    so the cost of SQLite writes shows up in the export metrics.
+    """
+    write_seconds = 0.0
+
+    def process_entities(self, tlo):
+        start = time.perf_counter()
+        super().process_entities(tlo)
+        self.write_seconds += time.perf_counter() - start
+
+    def save(self):
+        start = time.perf_counter()
+        super().save()
+        self.write_seconds += time.perf_counter() - start
+
+
+class TimedSQLiteSession(SessionWriteTimer, SQLiteSession):
+    """The regular on-disk session, with write timing."""
+
+
+class FlushingMemorySession(SessionWriteTimer, MemorySession):
+    """
+    In-memory session seeded from an on-disk SQLite session file.
+    Entities learned while exporting stay in memory and are written back
+    to the file by flush(), together with the current DC and auth key,
+    in one transaction at a time, so a crash can only lose changes made
+    since the last flush.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._pending = {}
+        with closing(sqlite3.connect(path)) as conn:
+            row = conn.execute("SELECT dc_id, server_address, port, auth_key, takeout_id FROM sessions").fetchone()
+            entities = conn.execute("SELECT id, hash, username, phone, name FROM entities").fetchall()
+        if row:
+            dc_id, server_address, port, auth_key, takeout_id = row
+            self.set_dc(dc_id, server_address, port)
+            self.auth_key = AuthKey(data=auth_key) if auth_key else None
+            self.takeout_id = takeout_id
+        self._entities = set(entities)
+        self._stored = {row[0]: row for row in entities}
+        self._flushed_session = self._session_row()
+
+    def _entities_to_rows(self, tlo):
+        # MemorySession keeps every variant of a row in an unordered set, so
+        # remember the latest row per id here for the next flush, skipping
+        # rows that are already on disk unchanged.
+        rows = super()._entities_to_rows(tlo)
+        stored, pending = self._stored, self._pending
+        for row in rows:
+            if stored.get(row[0]) != row:
+                pending[row[0]] = row
+        return rows
+
+    def _session_row(self):
+        return (self.dc_id, self.server_address, self.port,
+                self.auth_key.key if self.auth_key else b'', self.takeout_id)
+
+    def flush(self):
+        """Writes changed entities and session data to the session file. Returns how many entities were written."""
+        pending, session_row = self._pending, self._session_row()
+        if not pending and session_row == self._flushed_session:
+            return 0
+        self._pending = {}
+        start = time.perf_counter()
+        now = int(time.time())
+        try:
+            with closing(sqlite3.connect(self.path)) as conn:
+                with conn:
+                    if session_row != self._flushed_session:
+                        conn.execute("DELETE FROM sessions")
+                        conn.execute("INSERT INTO sessions VALUES (?, ?, ?, ?, ?)", session_row)
+                    conn.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?)",
+                                     [(*row, now) for row in pending.values()])
+        except sqlite3.Error:
+            pending.update(self._pending)
+            self._pending = pending
+            raise
+        self._stored.update(pending)
+        self._flushed_session = session_row
+        self.write_seconds += time.perf_counter() - start
+        return len(pending)
+
+
+class ChatStatistics:
+    """
+    Streaming aggregates computed while a chat is exported: messages per
+    day, per sender, per media type and the most frequent words. Words
+    are counted with a Misra-Gries sketch, so memory stays bounded no
+    matter how large the chat is. The state is saved with the summary,
+    which lets a later export of the same chat only add newer messages.
+    """
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.last_message_id = 0
+        self.total_messages = 0
+        self.per_day = {}
+        self.per_sender = {}
+        self.media = {}
+        self.word_counters = {}
+
+    @classmethod
+    def load(cls, path, chat_id):
+        """
+        Restores the state saved by write(). Starts fresh if the file belongs
+        to another chat or cannot be read back, e.g. a missing key.
+        """
+        if not os.path.exists(path):
+            return cls(chat_id)
+        stats = cls(chat_id)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get("chat_id") != chat_id:
+                return cls(chat_id)
+            stats.last_message_id = int(saved["last_message_id"])
+            stats.total_messages = int(saved["total_messages"])
+            stats.per_day = dict(saved["messages_per_day"])
+            stats.per_sender = dict(saved["messages_per_sender"])
+            stats.media = dict(saved["media"])
+            stats.word_counters = dict(saved["word_counters"])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            print(f"[LOG] Ignoring unreadable statistics file {path}.")
+            return cls(chat_id)
+        return stats
+
+    def add(self, message, sender, media_kind, text):
+        """
+        Folds one message in; words are counted from text, which the caller
+        has already scrubbed when redaction is on. Messages already covered
+        by a previous run are skipped.
+        """
+        if message.id <= self.last_message_id:
+            return
+        self.total_messages += 1
+        day = message.date.strftime('%Y-%m-%d')
+        self.per_day[day] = self.per_day.get(day, 0) + 1
+        self.per_sender[sender] = self.per_sender.get(sender, 0) + 1
+        if media_kind:
+            self.media[media_kind] = self.media.get(media_kind, 0) + 1
+        if text:
+            for word in WORD_PATTERN.findall(text.lower()):
+                self._count_word(word)
+
+    def finish(self, newest_message_id):
+        self.last_message_id = max(self.last_message_id, newest_message_id)
+
+    def _count_word(self, word):
+        counters = self.word_counters
+        if word in counters:
+            counters[word] += 1
+        elif len(counters) < STATS_WORD_COUNTERS:
+            counters[word] = 1
+        else:
+            for other in list(counters):
+                counters[other] -= 1
+                if not counters[other]:
+                    del counters[other]
+
+    def to_dict(self):
+        top_words = sorted(self.word_counters.items(), key=lambda item: item[1], reverse=True)[:STATS_TOP_WORDS]
+        return {
+            "chat_id": self.chat_id,
+            "last_message_id": self.last_message_id,
+            "total_messages": self.total_messages,
+            "messages_per_day": dict(sorted(self.per_day.items())),
+            "messages_per_sender": self.per_sender,
+            "media": self.media,
+            "top_words": [{"word": word, "min_count": count} for word, count in top_words],
+            "word_counters": self.word_counters
+        }
+
+    def write(self, path):
+        """Writes the summary through a temporary file so an interrupted write keeps the old one."""
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=4)
+        os.replace(f"{path}.tmp", path)
+
+
+class ContentRedactor:
+    """
+    Scrubs message content before it is written. Single-word keywords are
+    looked up in a set, one check per word of the message, so adding more
+    of them costs almost nothing. Multi-word keywords are folded into a
+    trie-shaped pattern and joined with the built-in phone/email patterns
+    and the custom regexes into one compiled regex. Custom regexes with
+    groups keep their own pass, so their backreferences stay valid.
+    """
+
+    def __init__(self, keywords=(), patterns=(), phone_numbers=True, emails=True, replacement="[REDACTED]"):
+        self.words = set()
+        phrases = []
+        for keyword in keywords:
+            if REDACTION_TOKEN_PATTERN.fullmatch(keyword):
+                self.words.add(keyword.lower())
+            elif keyword:
+                phrases.append(keyword)
+        alternatives = []
+        phrase_trie = self._trie_pattern(phrases)
+        if phrase_trie:
+            alternatives.append(f"(?i:(?<!\\w){phrase_trie}(?!\\w))")
+        if phone_numbers:
+            alternatives.append(PHONE_PATTERN)
+        if emails:
+            alternatives.append(EMAIL_PATTERN)
+        self.separate_patterns = []
+        for pattern in patterns:
+            try:
+                compiled = re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"Invalid redaction pattern {pattern!r}: {e}") from e
+            if compiled.groups:
+                self.separate_patterns.append(compiled)
+            else:
+                alternatives.append(self._scope_flags(pattern))
+        self.pattern = re.compile("|".join(f"(?:{alt})" for alt in alternatives)) if alternatives else None
+        self.replacement = replacement
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Loads rules from a JSON file, e.g.
+        {"keywords": ["..."], "patterns": ["..."], "phone_numbers": true,
+         "emails": true, "replacement": "[REDACTED]"}
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+        return cls(
+            keywords=rules.get("keywords", []),
+            patterns=rules.get("patterns", []),
+            phone_numbers=rules.get("phone_numbers", True),
+            emails=rules.get("emails", True),
+            replacement=rules.get("replacement", "[REDACTED]")
+        )
+
+    @staticmethod
+    def _scope_flags(pattern):
+        """Turns leading global flags like (?i) into a (?i:...) group, so they only apply to this pattern."""
+        flags = ""
+        while match := LEADING_FLAGS_PATTERN.match(pattern):
+            flags += match.group(1)
+            pattern = pattern[match.end():]
+        if not flags:
+            return pattern
+        # In verbose mode a trailing comment would swallow the closing parenthesis
+        return f"(?{flags}:{pattern}\n)" if "x" in flags else f"(?{flags}:{pattern})"
+
+    @staticmethod
+    def _trie_pattern(keywords):
+        """Builds a regex from a trie of the keywords, longest match first."""
+        trie = {}
+        for keyword in keywords:
+            if not keyword: continue
+            node = trie
+            for char in keyword.lower():
+                node = node.setdefault(char, {})
+            node[""] = {}
+
+        def build(node):
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ""
+            body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+            return f"(?:{body})?" if "" in node else body
+
+        return build(trie)
+
+    def _sub(self, replacement, text):
+        if self.pattern:
+            text = self.pattern.sub(replacement, text)
+        for pattern in self.separate_patterns:
+            text = pattern.sub(replacement, text)
+        words = self.words
+        if words and not words.isdisjoint(REDACTION_TOKEN_PATTERN.findall(text.lower())):
+            parts = REDACTION_SPLIT_PATTERN.split(text)
+            parts[1::2] = [replacement if part.lower() in words else part for part in parts[1::2]]
+            text = "".join(parts)
+        return text
+
+    def scrub(self, text):
+        """Removes every match outright, leaving nothing to count as words."""
+        return self._sub(" ", text) if text else text
+
+    def redact_batch(self, texts):
+        """Returns the texts with every match replaced; None entries are passed through."""
+        replacement = self.replacement
+        return [self._sub(replacement, text) if text else text for text in texts]
+
+
+class ParticipantWriter:
+    """
+    Writes participants to a txt or json file as they arrive, skipping
+    users already written by another query. It also remembers the first
+    letters of names, so searches can follow the scripts the group
+    actually uses.
+    """
+
+    def __init__(self, path, format_choice, include_phone=True):
+        self.path = path
+        self.format_choice = format_choice
+        self.include_phone = include_phone
+        self.seen = set()
+        self.initials = set()
+        self.file = open(path, 'w', encoding='utf-8')
+        if format_choice == 'json':
+            self.file.write("[")
+
+    def add(self, user):
+        """Writes the user if it is new. Returns True if it was."""
+        if user.id in self.seen:
+            return False
+        self.seen.add(user.id)
+        name = utils.get_display_name(user)
+        for word in name.lower().split():
+            self.initials.add(word[0])
+        if self.format_choice == 'json':
+            record = {"id": user.id, "username": user.username, "name": name, "bot": bool(user.bot)}
+            if self.include_phone:
+                record["phone"] = user.phone
+            separator = "\n" if len(self.seen) == 1 else ",\n"
+            self.file.write(f"{separator}    {json.dumps(record, ensure_ascii=False)}")
+        else:
+            self.file.write(f"{user.id}\t@{user.username or '-'}\t{name}\n")
+        return True
+
+    def close(self):
+        if self.format_choice == 'json':
+            self.file.write("\n]\n")
+        self.file.close()
+
+
+class ParallelDownloader:
+    """
+    Downloads large files part by part over several MTProto connections
+    at once, writing each part straight to its offset in a preallocated
+    file. Connections to a data center are authorized once and kept for
+    the following files; close() disconnects them. An exported
+    authorization the data center no longer accepts is forgotten, so the
+    next download exports a fresh one.
+    """
+
+    def __init__(self, client, connections=MEDIA_DOWNLOAD_CONNECTIONS):
+        self.client = client
+        self.connections = connections
+        self.auth_keys = {}
+        self.senders = {}
+        self.lock = asyncio.Lock()
+
+    async def _get_senders(self, dc_id):
+        async with self.lock:
+            senders = self.senders.setdefault(dc_id, [])
+            while len(senders) < self.connections:
+                senders.append(await self._create_sender(dc_id))
+            return senders
+
+    async def _create_sender(self, dc_id):
+        """Connects a new sender to dc_id, exporting our authorization there on first use."""
+        client = self.client
+        auth_key = client.session.auth_key if dc_id == client.session.dc_id else self.auth_keys.get(dc_id)
+        dc = await client._get_dc(dc_id)
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address, dc.port, dc.id, loggers=client._log, proxy=client._proxy, local_addr=client._local_addr
+        ))
+        if not auth_key:
+            print(f"[LOG] Exporting authorization to DC {dc_id}.")
+            try:
+                exported = await client(ExportAuthorizationRequest(dc_id))
+                client._init_request.query = ImportAuthorizationRequest(id=exported.id, bytes=exported.bytes)
+                await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+            except BaseException:
+                await sender.disconnect()
+                raise
+            self.auth_keys[dc_id] = sender.auth_key
+        return sender
+
+    async def _drop_senders(self, dc_id):
+        async with self.lock:
+            for sender in self.senders.pop(dc_id, []):
+                await sender.disconnect()
+
+    async def download(self, location, dc_id, size, path):
+        senders = await self._get_senders(dc_id)
+        parts = iter(range((size + MEDIA_PART_SIZE - 1) // MEDIA_PART_SIZE))
+        try:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+
+                async def fetch_parts(sender):
+                    for part in parts:
+                        offset = part * MEDIA_PART_SIZE
+                        result = await self.client._call(
+                            sender, GetFileRequest(location=location, offset=offset, limit=MEDIA_PART_SIZE)
+                        )
+                        f.seek(offset)
+                        f.write(result.bytes)
+
+                # On the first failure the remaining part fetches are cancelled
+                # and awaited, so none of them touch the file or the senders
+                # after this method gives up.
+                tasks = [asyncio.ensure_future(fetch_parts(sender)) for sender in senders]
+                try:
+                    await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+        except BaseException as e:
+            if os.path.exists(path):
+                os.remove(path)
+            await self._drop_senders(dc_id)
+            if isinstance(e, (UnauthorizedError, AuthKeyError, AuthKeyNotFound)):
+                self.auth_keys.pop(dc_id, None)
+            raise
+
+    async def close(self):
+        for dc_id in list(self.senders):
+            await self._drop_senders(dc_id)
+
+
+class ExportJob:
+    """State of one export requested through the local service."""
+
+    def __init__(self, job_id, target):
+        self.id = job_id
+        self.target = target
+        self.status = "running"
+        self.records = 0
+        self.error = None
+        self.task = None
+        self.cancel_requested = False
+
+    def cancel(self):
+        """Cancels the job on a client's request; the stream then ends with a 'cancelled' status line."""
+        if self.status == "running" and self.task:
+            self.cancel_requested = True
+            self.task.cancel()
+
+    def to_dict(self):
+        return {"id": self.id, "target": self.target, "status": self.status,
+                "records": self.records, "error": self.error}
+
+
+class ExportService:
+    """
+    Minimal local HTTP API that runs exports on the worker's event loop
+    and already authorized client, streaming records back as NDJSON
+    while they are fetched:
+
+        POST   /exports        {"target": "...", "limit": 100, "min_id": 0, "reverse": false}
+        GET    /exports        status of all jobs
+        GET    /exports/<id>   status of one job
+        DELETE /exports/<id>   cancels a running job
+
+    Every request needs 'Authorization: Bearer <token>'. Over TCP the Host
+    header must name the loopback address, which stops web pages from
+    reaching the service through DNS rebinding. The last line of an export
+    stream is always {"status": ...}, so clients can tell a complete
+    export from a truncated one.
+    """
+
+    def __init__(self, worker, token):
+        self.worker = worker
+        self.token = token
+        self.allowed_hosts = None
+        self.jobs = {}
+        self.next_job_id = 1
+        self.server = None
+
+    async def start(self, port=None, socket_path=None):
+        if socket_path:
+            self.server = await asyncio.start_unix_server(self._handle, path=socket_path)
+            os.chmod(socket_path, 0o600)
+            print(f"[LOG] Export service listening on {socket_path}.")
+        else:
+            self.server = await asyncio.start_server(self._handle, SERVICE_HOST, port)
+            self.allowed_hosts = {f"{SERVICE_HOST}:{port}", f"localhost:{port}"}
+            print(f"[LOG] Export service listening on http://{SERVICE_HOST}:{port}.")
+
+    async def close(self):
+        for job in self.jobs.values():
+            if job.status == "running" and job.task:
+                job.task.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0], request_line[1]
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode('latin-1').partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if self.allowed_hosts is not None and headers.get("host", "").lower() not in self.allowed_hosts:
+                return await self._respond(writer, 403, {"error": "Unexpected Host header."})
+            scheme, _, token = headers.get("authorization", "").partition(" ")
+            if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), self.token.encode()):
+                return await self._respond(writer, 401, {"error": "Missing or invalid token."})
+            # The body is only read once the request is known to be allowed, and never past SERVICE_MAX_BODY.
+            try:
+                length = int(headers.get("content-length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                return await self._respond(writer, 400, {"error": "Invalid Content-Length."})
+            if length > SERVICE_MAX_BODY:
+                return await self._respond(writer, 413, {"error": f"Request body over {SERVICE_MAX_BODY} bytes."})
+            if method == "POST" and headers.get("content-type", "").split(";")[0].strip() != "application/json":
+                return await self._respond(writer, 415, {"error": "Expected Content-Type: application/json."})
+            body = await reader.readexactly(length)
+            await self._route(method, path.strip("/").split("/"), body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"[ERROR] Service request failed: {e}")
+        finally:
+            writer.close()
+
+    async def _route(self, method, parts, body, writer):
+        if parts[0] != "exports" or len(parts) > 2:
+            return await self._respond(writer, 404, {"error": "Not found."})
+        job = None
+        if len(parts) == 2:
+            job = self.jobs.get(parts[1])
+            if job is None:
+                return await self._respond(writer, 404, {"error": "No such job."})
+        if method == "POST" and job is None:
+            return await self._run_job(body, writer)
+        if method == "GET":
+            return await self._respond(writer, 200, job.to_dict() if job else [j.to_dict() for j in self.jobs.values()])
+        if method == "DELETE" and job:
+            job.cancel()
+            return await self._respond(writer, 200, job.to_dict())
+        return await self._respond(writer, 405, {"error": "Method not allowed."})
+
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+    async def _run_job(self, body, writer):
+        try:
+            params = json.loads(body or b"{}")
+            target = params["target"]
+        except (ValueError, KeyError, TypeError):
+            return await self._respond(writer, 400, {"error": "Expected a JSON body with a 'target'."})
+
+        job = ExportJob(str(self.next_job_id), target)
+        self.next_job_id += 1
+        self.jobs[job.id] = job
+        finished = [j.id for j in self.jobs.values() if j.status != "running"]
+        for job_id in finished[:max(0, len(finished) - SERVICE_JOB_HISTORY)]:
+            del self.jobs[job_id]
+        job.task = asyncio.current_task()
+        print(f"[LOG] Service job {job.id}: exporting '{target}'.")
+
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     f"X-Job-Id: {job.id}\r\nConnection: close\r\n\r\n".encode('latin-1'))
+        try:
+            records = self.worker._iter_records(
+                target, limit=params.get("limit"), min_id=params.get("min_id", 0), reverse=params.get("reverse", False)
+            )
+            async for record in records:
+                writer.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+                job.records += 1
+                await writer.drain()
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            if not job.cancel_requested:
+                # Cancelled by close() or the loop shutting down, not by DELETE.
+                raise
+            if hasattr(job.task, "uncancel"):
+                job.task.uncancel()
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            print(f"[LOG] Service job {job.id}: {job.status} after {job.records} records.")
+        status_line = {"status": job.status, "records": job.records}
+        if job.error:
+            status_line["error"] = job.error
+        writer.write(json.dumps(status_line, ensure_ascii=False).encode('utf-8') + b"\n")
+        await writer.drain()
+
+
+class FloodWaitRecorder(logging.Handler):
+    """
+    Telethon sleeps through short flood waits on its own and only logs them,
+    at INFO on the 'telethon.client.users' logger. This handler turns those
+    log records into trace spans and counters while it is attached.
+    """
+    logger_name = "telethon.client.users"
+
+    def __init__(self, tracer):
+        super().__init__(logging.INFO)
+        self.tracer = tracer
+        self.logger = logging.getLogger(self.logger_name)
+        self.previous_level = None
+
+    def attach(self):
+        """Starts recording; the logger is lowered to INFO so the records are created at all."""
+        self.previous_level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self)
+
+    def detach(self):
+        self.logger.removeHandler(self)
+        self.logger.setLevel(self.previous_level)
+
+    def emit(self, record):
+        if "flood wait" not in str(record.msg):
+            return
+        # Telethon formats these as ('Sleeping%s for %ds (%s) on %s flood wait', early, seconds, ...)
+        try:
+            seconds = float(record.args[1])
+        except (TypeError, ValueError, IndexError):
+            seconds = 0.0
+        self.tracer.count("flood_waits")
+        self.tracer.count("flood_wait_seconds", seconds)
+        self.tracer.add_span("flood_wait", self.tracer.now_us(), seconds * 1_000_000)
+
 
 class AsyncioWorker(QObject):
     """
@@ -36,6 +802,9 @@ class AsyncioWorker(QObject):
         self.client = None
         self.session_name = "my_session"
         self.input_response = None
+        self.flush_task = None
+        self.downloader = None
+        self.service = None
 
     def run(self):
         """Starts the asyncio event loop."""
@@ -51,6 +820,12 @@ class AsyncioWorker(QObject):
     def stop(self):
         """Stops the event loop and disconnects the client."""
         async def shutdown_sequence():
+            if self.flush_task:
+                self.flush_task.cancel()
+                self.flush_task = None
+            self._flush_session()
+            await self._close_service()
+            await self._close_downloader()
             if self.client and self.client.is_connected():
                 print("[LOG] Disconnecting client...")
                 await self.client.disconnect()
@@ -73,6 +848,38 @@ class AsyncioWorker(QObject):
             time.sleep(0.1)
         return self.input_response
 
+    def _create_session(self, config):
+        """Picks the session backend; 'memory_session' in the config keeps it in RAM while running."""
+        if config.get("memory_session"):
+            print("[LOG] Using in-memory session.")
+            if not os.path.exists(f"{self.session_name}.session"):
+                # Creates an empty session file with the schema flush() writes into.
+                SQLiteSession(self.session_name).close()
+            return FlushingMemorySession(f"{self.session_name}.session")
+        return TimedSQLiteSession(self.session_name)
+
+    def _start_session_flushing(self):
+        """Writes an in-memory session to disk now and then every SESSION_FLUSH_INTERVAL seconds."""
+        if isinstance(self.client.session, FlushingMemorySession) and not self.flush_task:
+            self._flush_session()
+            self.flush_task = self.loop.create_task(self._flush_session_periodically())
+
+    def _flush_session(self):
+        session = self.client.session if self.client else None
+        if not isinstance(session, FlushingMemorySession) or not os.path.exists(session.path):
+            return
+        try:
+            written = session.flush()
+            if written:
+                print(f"[LOG] Flushed {written} entities to {session.path}.")
+        except sqlite3.Error as e:
+            print(f"[ERROR] Failed to flush session: {e}")
+
+    async def _flush_session_periodically(self):
+        while True:
+            await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+            self._flush_session()
+
     async def _async_check_login(self, config):
         if not os.path.exists(f"{self.session_name}.session") or not config:
             print("[LOG] No session or config found. Showing login page.")
@@ -81,10 +888,12 @@ class AsyncioWorker(QObject):
 
         print("[LOG] Session and config found. Attempting to connect...")
         try:
-            self.client = TelegramClient(self.session_name, int(config['api_id']), config['api_hash'], loop=self.loop)
+            self.client = TelegramClient(self._create_session(config), int(config['api_id']), config['api_hash'], loop=self.loop)
             await self.client.connect()
             if await self.client.is_user_authorized():
                 print("[LOG] Connection successful. User is authorized.")
+                self._start_session_flushing()
+                await self._start_service(config)
                 self.show_exporter_frame.emit()
             else:
                 print("[LOG] Session is invalid or expired.")
@@ -97,7 +906,7 @@ class AsyncioWorker(QObject):
         print("[LOG] Starting login logic in network thread.")
         self.task_started.emit("Logging in...")
         try:
-            self.client = TelegramClient(self.session_name, int(api_id), api_hash, loop=self.loop)
+            self.client = TelegramClient(self._create_session(load_config()), int(api_id), api_hash, loop=self.loop)
             await self.client.connect()
             self.task_started.emit("Sending login code...")
             sent_code = await self.client.send_code_request(phone)
@@ -121,6 +930,8 @@ class AsyncioWorker(QObject):
 
             self.task_finished.emit("Login successful!")
             print("[LOG] Login with password successful!")
+            self._start_session_flushing()
+            await self._start_service(load_config())
             self.show_exporter_frame.emit()
 
         except Exception as e:
@@ -129,53 +940,551 @@ class AsyncioWorker(QObject):
             if self.client and self.client.is_connected():
                 await self.client.disconnect()
 
-    async def _async_export(self, target_username, base_filename, format_choice):
+    async def _async_export(self, target_username, base_filename, format_choice, trace=False, threads=False, stats=False,
+                            redaction_rules=None, participants=False, download_media=False, comments=False):
         final_filename = base_filename
         if not final_filename.lower().endswith(('.txt', '.json')):
             final_filename = f"{base_filename}.{format_choice}"
 
         print(f"[LOG] Starting export for '{target_username}' to '{final_filename}'.")
+        tracer = ExportTracer()
+        flood_recorder = FloodWaitRecorder(tracer)
+        flood_recorder.attach()
+        session_writes_before = self.client.session.write_seconds
         try:
+            redactor = ContentRedactor.from_file(redaction_rules) if redaction_rules else None
+
             self.task_started.emit(f"Finding user '{target_username}'...")
-            target_entity = await self.client.get_entity(target_username)
-            print(f"[LOG] Found entity: {target_entity.first_name}")
+            with tracer.span("get_entity", target=target_username):
+                target_entity = await self.client.get_entity(target_username)
+            print(f"[LOG] Found entity: {utils.get_display_name(target_entity)}")
+
+            stats_filename = f"{os.path.splitext(final_filename)[0]}.stats.json"
+            chat_stats = ChatStatistics.load(stats_filename, target_entity.id) if stats else None
+            newest_message_id = 0
+
+            media_dir = f"{os.path.splitext(final_filename)[0]}_media" if download_media else None
+            if media_dir:
+                os.makedirs(media_dir, exist_ok=True)
+
+            fetch_comments = comments and isinstance(target_entity, Channel) and target_entity.broadcast
+            commented_posts = []
 
             all_messages_data = []
+            message_index = {}
+            seen_ids = set()
             total_fetched = 0
+            total_seen = 0
             self.task_started.emit("Starting message export...")
 
-            async for message in self.client.iter_messages(target_entity):
-                content = self.get_message_content(message)
-                if not content: continue
-
-                all_messages_data.append({
-                    "timestamp": message.date.strftime('%Y-%m-%d %H:%M:%S'),
-                    "sender": "You" if message.out else target_entity.first_name or target_username,
-                    "content": content
-                })
-                total_fetched += 1
-                if total_fetched % 100 == 0:
-                    self.task_started.emit(f"Fetched {total_fetched} messages so far...")
+            with tracer.span("fetch_history"):
+                # Pages only cover the time spent waiting on iter_messages, not
+                # the processing and media downloads done for each message.
+                page_start = None
+                page_wait_us = 0
+                messages = self.client.iter_messages(target_entity).__aiter__()
+                while True:
+                    wait_start = tracer.now_us()
+                    try:
+                        message = await messages.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    page_wait_us += tracer.now_us() - wait_start
+                    if page_start is None:
+                        page_start = wait_start
+                    total_seen += 1
+                    newest_message_id = max(newest_message_id, message.id)
+                    extract_start = time.perf_counter()
+                    content = self.get_message_content(message)
+                    tracer.observe("extract_us", (time.perf_counter() - extract_start) * 1_000_000)
+                    if total_seen % HISTORY_PAGE_SIZE == 0:
+                        self._trace_history_page(tracer, page_start, page_wait_us, HISTORY_PAGE_SIZE)
+                        page_start, page_wait_us = None, 0
+                    if threads:
+                        seen_ids.add(message.id)
+                    if not content: continue
+
+                    record = {
+                        "timestamp": message.date.strftime('%Y-%m-%d %H:%M:%S'),
+                        "sender": self._sender_name(message, target_entity, target_username),
+                        "content": content
+                    }
+                    if threads:
+                        record["id"] = message.id
+                        record.update(self._reply_fields(message, target_entity))
+                        forward = self._forward_info(message)
+                        if forward:
+                            record["forwarded_from"] = forward
+                        message_index[message.id] = record
+                    if media_dir and self._media_kind(message):
+                        record["media_file"] = await self._download_message_media(message, media_dir, tracer)
+                    if chat_stats:
+                        text = redactor.scrub(message.raw_text) if redactor else message.raw_text
+                        chat_stats.add(message, record["sender"], self._media_kind(message), text)
+                    if fetch_comments and message.replies and message.replies.replies:
+                        commented_posts.append((message.id, record))
+                    all_messages_data.append(record)
+                    total_fetched += 1
+                    if total_fetched % 100 == 0:
+                        self.task_started.emit(f"Fetched {total_fetched} messages so far...")
+                if total_seen % HISTORY_PAGE_SIZE:
+                    self._trace_history_page(tracer, page_start, page_wait_us, total_seen % HISTORY_PAGE_SIZE)
+            tracer.count("messages_seen", total_seen)
+            tracer.count("messages_exported", total_fetched)
 
             all_messages_data.reverse()
 
-            with open(final_filename, 'w', encoding='utf-8') as f:
-                if format_choice == 'json':
-                    json.dump(all_messages_data, f, ensure_ascii=False, indent=4)
+            if commented_posts:
+                with tracer.span("fetch_comments", posts=len(commented_posts)):
+                    await self._fetch_comment_threads(target_entity, target_username, commented_posts, tracer)
+
+            if threads:
+                self.task_started.emit("Resolving reply threads...")
+                with tracer.span("resolve_replies"):
+                    await self._resolve_reply_threads(
+                        target_entity, target_username, all_messages_data, message_index, seen_ids, tracer
+                    )
+
+            if redactor:
+                self.task_started.emit("Redacting content...")
+                self._redact_records(redactor, all_messages_data, tracer)
+
+            with tracer.span("write_file", format=format_choice):
+                with open(final_filename, 'w', encoding='utf-8') as f:
+                    if format_choice == 'json':
+                        json.dump(all_messages_data, f, ensure_ascii=False, indent=4)
+                    else:
+                        for msg in all_messages_data:
+                            f.write(self._format_txt_message(msg))
+            tracer.count("bytes_written", os.path.getsize(final_filename))
+
+            if chat_stats:
+                with tracer.span("write_stats"):
+                    chat_stats.finish(newest_message_id)
+                    chat_stats.write(stats_filename)
+                print(f"[LOG] Wrote statistics to {stats_filename}.")
+
+            result = f"Success! Exported {len(all_messages_data)} messages."
+            if tracer.counters.get("comment_thread_errors"):
+                result += f" Comments for {tracer.counters['comment_thread_errors']} posts could not be fetched."
+            if tracer.counters.get("media_download_errors"):
+                result += f" {tracer.counters['media_download_errors']} media files could not be downloaded."
+            if participants:
+                if isinstance(target_entity, (Channel, Chat)):
+                    participants_filename = f"{os.path.splitext(final_filename)[0]}_participants.{format_choice}"
+                    try:
+                        with tracer.span("export_participants"):
+                            collected, total = await self._export_participants(
+                                target_entity, participants_filename, format_choice, tracer, redact=redactor is not None
+                            )
+                        result += f" Collected {collected} of {total} members."
+                    except RPCError as e:
+                        print(f"[ERROR] Participants unavailable: {e}")
+                        result += f" Participants unavailable: {e}"
                 else:
-                    for msg in all_messages_data:
-                        f.write(f"[{msg['timestamp']}] {msg['sender']}: {msg['content']}\n")
+                    print("[LOG] Target is not a group or channel, skipping participants.")
+
+            tracer.count("session_write_seconds", self.client.session.write_seconds - session_writes_before)
+            phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in tracer.phase_totals().items())
+            print(f"[LOG] Export phases: {phases}, session writes {tracer.counters['session_write_seconds']:.2f}s")
+            if trace:
+                tracer.write(os.path.splitext(final_filename)[0])
+                print("[LOG] Wrote trace and metrics files.")
 
-            self.task_finished.emit(f"Success! Exported {len(all_messages_data)} messages.")
+            self.task_finished.emit(result)
             print("[LOG] Export complete.")
             open_file(final_filename)
 
         except Exception as e:
             self.task_error.emit(f"Error: {e}")
             print(f"[ERROR] An exception occurred during export: {e}")
+        finally:
+            flood_recorder.detach()
+
+    async def _resolve_reply_threads(self, target_entity, target_username, records, message_index, seen_ids, tracer):
+        """
+        Replaces reply ids with a short reference to the parent message and
+        tags every reply with the id of its thread root. Parents found in the
+        export are resolved from the index built during the fetch; only the
+        ones outside the exported range are requested, in batches.
+        """
+        wanted = {record["reply_to"] for record in records if "reply_to" in record}
+        missing = sorted(wanted - message_index.keys() - seen_ids)
+        outside = {}
+        for i in range(0, len(missing), REPLY_FETCH_BATCH_SIZE):
+            batch = missing[i:i + REPLY_FETCH_BATCH_SIZE]
+            try:
+                fetched = await self.client.get_messages(target_entity, ids=batch)
+            except (RPCError, ConnectionError, TimeoutError) as e:
+                # Like deleted parents, these replies just stay unresolved.
+                print(f"[ERROR] Could not fetch {len(batch)} reply parents: {e}")
+                tracer.count("reply_parent_batch_errors")
+                continue
+            tracer.count("reply_parents_fetched", len(batch))
+            for message in fetched:
+                if message is None: continue
+                outside[message.id] = {
+                    "timestamp": message.date.strftime('%Y-%m-%d %H:%M:%S'),
+                    "sender": self._sender_name(message, target_entity, target_username),
+                    "content": self.get_message_content(message)
+                }
+
+        roots = {}
+        for record in records:
+            if "reply_to" not in record: continue
+            root, visited = record["reply_to"], {record["id"]}
+            while root in message_index and "reply_to" in message_index[root] and root not in visited:
+                visited.add(root)
+                root = message_index[root]["reply_to"]
+            roots[record["id"]] = root
+
+        for record in records:
+            if "reply_to" not in record: continue
+            parent_id = record["reply_to"]
+            parent = message_index.get(parent_id) or outside.get(parent_id) or {}
+            record["reply_to"] = {"id": parent_id, "sender": parent.get("sender"), "content": parent.get("content")}
+            record["thread_id"] = roots[record["id"]]
+        tracer.count("replies_resolved", len(roots))
+
+    async def _export_participants(self, target_entity, filename, format_choice, tracer, redact=False):
+        """
+        Collects the member list of a group or channel. The server caps how
+        many members one query returns, so after a plain 'recent' query the
+        work is split into concurrent queries per participant filter and
+        per search prefix, deduplicated by user id as results stream in.
+        A search whose own match count is higher than what it returned was
+        capped, and is refined by the letters that follow the prefix in the
+        names it did return ('a' -> 'al', 'an', ...), within a budget of
+        PARTICIPANT_MAX_SEARCHES queries. First letters seen in collected
+        names seed further searches, which covers non-Latin scripts. Phone
+        numbers are left out when redact is set. Errors of the first query
+        (e.g. a channel where you are not an admin) are raised. Returns
+        (collected, reported_total).
+        """
+        self.task_started.emit("Exporting participants...")
+        total = (await self.client.get_participants(target_entity, limit=0)).total
+        channel = await self.client.get_input_entity(target_entity)
+        writer = ParticipantWriter(filename, format_choice, include_phone=not redact)
+        semaphore = asyncio.Semaphore(PARTICIPANT_CONCURRENCY)
+        searches_left = PARTICIPANT_MAX_SEARCHES
+
+        def add_users(users):
+            for user in users:
+                if writer.add(user) and len(writer.seen) % 500 == 0:
+                    self.task_started.emit(f"Collected {len(writer.seen)} of {total} members...")
+
+        async def search_pages(search):
+            """
+            Yields (users, count) per page of a search. Unlike iter_participants,
+            whose total is the whole group's, count is the number of members
+            matching this search.
+            """
+            offset = 0
+            while True:
+                page = await self.client(GetParticipantsRequest(
+                    channel, ChannelParticipantsSearch(search), offset, PARTICIPANT_PAGE_SIZE, hash=0
+                ))
+                users = {user.id: user for user in page.users}
+                page_users = [users[p.user_id] for p in page.participants if getattr(p, "user_id", None) in users]
+                yield page_users, page.count
+                offset += len(page.participants)
+                if not page.participants or offset >= page.count:
+                    return
+
+        async def run_query(participant_filter=None, search='', required=False):
+            """
+            Runs one query and returns (users returned, users the server
+            reports for it). Errors are logged and counted unless required.
+            """
+            returned, reported = [], 0
+            async with semaphore:
+                filter_name = "ChannelParticipantsSearch" if search else getattr(participant_filter, "__name__", None)
+                with tracer.span("participant_query", filter=filter_name, search=search):
+                    try:
+                        if search:
+                            async for users, reported in search_pages(search):
+                                returned.extend(users)
+                                add_users(users)
+                        else:
+                            participants = self.client.iter_participants(target_entity, filter=participant_filter)
+                            async for user in participants:
+                                returned.append(user)
+                                add_users((user,))
+                            reported = participants.total or len(returned)
+                    except RPCError as e:
+                        if required:
+                            raise
+                        print(f"[ERROR] Participant query failed (filter={filter_name}, search='{search}'): {e}")
+                        tracer.count("participant_query_errors")
+                        reported = len(returned)
+            return returned, reported
+
+        def next_chars(users, prefix):
+            """Returns the letters that follow the prefix in the names and usernames of users."""
+            chars = set()
+            for user in users:
+                for word in f"{utils.get_display_name(user)} {user.username or ''}".lower().split():
+                    if len(word) > len(prefix) and word.startswith(prefix):
+                        chars.add(word[len(prefix)])
+            return chars
+
+        async def search_prefix(prefix):
+            nonlocal searches_left
+            if searches_left <= 0:
+                tracer.count("participant_searches_skipped")
+                return
+            searches_left -= 1
+            users, reported = await run_query(search=prefix)
+            if len(users) < reported and len(prefix) < PARTICIPANT_MAX_PREFIX_LENGTH and len(writer.seen) < total:
+                tracer.count("participant_prefixes_refined")
+                await asyncio.gather(*(search_prefix(prefix + char) for char in sorted(next_chars(users, prefix))))
+
+        try:
+            await run_query(required=True)
+            if isinstance(target_entity, Channel) and len(writer.seen) < total:
+                await asyncio.gather(*(run_query(participant_filter=f) for f in PARTICIPANT_FILTERS[1:]))
+                searched = set()
+                prefixes = set(PARTICIPANT_SEARCH_PREFIXES)
+                while prefixes and searches_left > 0 and len(writer.seen) < total:
+                    searched |= prefixes
+                    await asyncio.gather(*(search_prefix(prefix) for prefix in sorted(prefixes)))
+                    prefixes = writer.initials - searched
+        finally:
+            writer.close()
+
+        if tracer.counters.get("participant_searches_skipped"):
+            print(f"[LOG] Stopped searching participants after {PARTICIPANT_MAX_SEARCHES} queries.")
+
+        collected = len(writer.seen)
+        tracer.count("participants_collected", collected)
+        coverage = collected / total * 100 if total else 100.0
+        print(f"[LOG] Collected {collected} of {total} members ({coverage:.1f}%) into {filename}.")
+        return collected, total
+
+    async def _download_message_media(self, message, media_dir, tracer):
+        """
+        Saves the message's attachment into media_dir and returns its path,
+        or None if it could not be downloaded. An expired file reference is
+        renewed by fetching the message again once.
+        """
+        name = os.path.basename(message.file.name or f"media{message.file.ext or ''}")
+        path = os.path.join(media_dir, f"{message.id}_{name}")
+        try:
+            try:
+                return await self._save_media(message, path, tracer)
+            except FileReferenceExpiredError:
+                tracer.count("media_file_references_refreshed")
+                refreshed = await self.client.get_messages(message.peer_id, ids=message.id)
+                if refreshed is None or not refreshed.media:
+                    raise
+                return await self._save_media(refreshed, path, tracer)
+        except Exception as e:
+            print(f"[ERROR] Could not download media of message {message.id}: {e}")
+            tracer.count("media_download_errors")
+            return None
+
+    async def _save_media(self, message, path, tracer):
+        size = message.file.size or 0
+        with tracer.span("download_media", bytes=size):
+            if message.document and size > LARGE_MEDIA_THRESHOLD:
+                if self.downloader is None:
+                    self.downloader = ParallelDownloader(self.client)
+                dc_id, location = utils.get_input_location(message.media)
+                self.task_started.emit(f"Downloading {os.path.basename(path)} ({size // (1024 * 1024)} MB)...")
+                await self.downloader.download(location, dc_id, size, path)
+                tracer.count("large_media_files")
+            else:
+                path = await self.client.download_media(message, file=path)
+        tracer.count("media_bytes", size)
+        return path
+
+    async def _iter_records(self, target_username, limit=None, min_id=0, reverse=False):
+        """Yields export records one by one as they are fetched, for the local service."""
+        target_entity = await self.client.get_entity(target_username)
+        async for message in self.client.iter_messages(target_entity, limit=limit, min_id=min_id, reverse=reverse):
+            content = self.get_message_content(message)
+            if not content: continue
+            record = {
+                "id": message.id,
+                "timestamp": message.date.strftime('%Y-%m-%d %H:%M:%S'),
+                "sender": self._sender_name(message, target_entity, target_username),
+                "content": content,
+                "forwarded_from": self._forward_info(message)
+            }
+            record.update(self._reply_fields(message, target_entity))
+            yield record
+
+    async def _start_service(self, config):
+        """Starts the local export service if the config asks for it. A failure to start is only logged."""
+        if self.service or not (config.get("service_port") or config.get("service_socket")):
+            return
+        token = config.get("service_token")
+        if not token:
+            token = secrets.token_urlsafe(32)
+            stored = load_config()
+            stored["service_token"] = token
+            save_config(stored)
+            print(f"[LOG] Generated a service token and saved it to {CONFIG_FILE}.")
+        service = ExportService(self, token)
+        try:
+            await service.start(config.get("service_port"), config.get("service_socket"))
+        except Exception as e:
+            # The service is optional; login and exports work without it.
+            print(f"[ERROR] Could not start the export service: {e}")
+            await service.close()
+            return
+        self.service = service
+
+    async def _close_service(self):
+        if self.service:
+            await self.service.close()
+            self.service = None
+
+    async def _close_downloader(self):
+        if self.downloader:
+            await self.downloader.close()
+            self.downloader = None
+
+    async def _fetch_comment_threads(self, target_entity, target_username, commented_posts, tracer):
+        """
+        Fetches the discussion-group comments of channel posts concurrently,
+        at most COMMENT_CONCURRENCY threads at a time, and nests them under
+        their post's record, oldest first. A thread that cannot be fetched
+        keeps what was fetched so far and is marked with 'comments_error'
+        instead of failing the export.
+        """
+        semaphore = asyncio.Semaphore(COMMENT_CONCURRENCY)
+        done = 0
+        self.task_started.emit(f"Fetching comments for {len(commented_posts)} posts...")
+
+        async def fetch_thread(post_id, record):
+            nonlocal done
+            thread = []
+            async with semaphore:
+                with tracer.span("comment_thread", post=post_id):
+                    try:
+                        async for message in self.client.iter_messages(target_entity, reply_to=post_id, reverse=True):
+                            content = self.get_message_content(message)
+                            if not content: continue
+                            thread.append({
+                                "timestamp": message.date.strftime('%Y-%m-%d %H:%M:%S'),
+                                "sender": self._sender_name(message, target_entity, target_username),
+                                "content": content
+                            })
+                    except Exception as e:
+                        print(f"[ERROR] Could not fetch comments for post {post_id}: {e}")
+                        tracer.count("comment_thread_errors")
+                        record["comments_error"] = str(e)
+            record["comments"] = thread
+            tracer.count("comments_fetched", len(thread))
+            done += 1
+            if done % 50 == 0:
+                self.task_started.emit(f"Fetched comments for {done} of {len(commented_posts)} posts...")
+
+        await asyncio.gather(*(fetch_thread(post_id, record) for post_id, record in commented_posts))
+
+    def _redact_records(self, redactor, records, tracer):
+        """Runs the redactor over record contents, quoted reply parents and comments, in batches."""
+        for i in range(0, len(records), REDACTION_BATCH_SIZE):
+            batch = records[i:i + REDACTION_BATCH_SIZE]
+            parents = [record["reply_to"] for record in batch if isinstance(record.get("reply_to"), dict)]
+            comments = [comment for record in batch for comment in record.get("comments", ())]
+            with tracer.span("redact_batch", records=len(batch)):
+                for record, content in zip(batch, redactor.redact_batch([r["content"] for r in batch])):
+                    record["content"] = content
+                for parent, content in zip(parents, redactor.redact_batch([p["content"] for p in parents])):
+                    parent["content"] = content
+                for comment, content in zip(comments, redactor.redact_batch([c["content"] for c in comments])):
+                    comment["content"] = content
+            tracer.count("records_redacted", len(batch))
+
+    def _media_kind(self, message):
+        if message.photo: return "photo"
+        if message.video: return "video"
+        if message.voice: return "voice"
+        if message.sticker: return "sticker"
+        if message.document: return "document"
+        return None
+
+    def _sender_name(self, message, target_entity, target_username):
+        if message.out:
+            return "You"
+        if isinstance(target_entity, (Channel, Chat)) and message.sender:
+            return utils.get_display_name(message.sender)
+        return getattr(target_entity, "first_name", None) or target_username
+
+    def _reply_fields(self, message, target_entity):
+        """
+        Returns the reply fields for a record. Only replies inside the
+        exported chat get 'reply_to', since those ids are resolved against
+        it; replies to other chats keep their peer in 'reply_to_external'.
+        In forums, a message that merely belongs to a topic gets 'topic_id'
+        instead of being treated as a reply to the topic's first message.
+        """
+        header = message.reply_to
+        if not header or not getattr(header, "reply_to_msg_id", None):
+            return {}
+        fields = {}
+        parent_id = header.reply_to_msg_id
+        if header.forum_topic:
+            if header.reply_to_top_id:
+                fields["topic_id"] = header.reply_to_top_id
+            else:
+                return {"topic_id": parent_id}
+        peer = header.reply_to_peer_id
+        if peer and utils.get_peer_id(peer) != utils.get_peer_id(target_entity):
+            fields["reply_to_external"] = {"peer_id": utils.get_peer_id(peer), "id": parent_id}
+        else:
+            fields["reply_to"] = parent_id
+        return fields
+
+    def _forward_info(self, message):
+        """Returns where a forwarded message originally came from, or None."""
+        header = message.fwd_from
+        if not header:
+            return None
+        origin = header.from_name
+        if not origin and header.from_id:
+            origin = utils.get_peer_id(header.from_id)
+        return {"from": origin, "date": header.date.strftime('%Y-%m-%d %H:%M:%S') if header.date else None}
+
+    def _format_txt_message(self, msg):
+        """Formats one record as txt, quoting the parent of a reply above it and indenting its comments below."""
+        line = f"[{msg['timestamp']}] {msg['sender']}: "
+        forward = msg.get("forwarded_from")
+        if forward:
+            line += f"[Forwarded from {forward['from']}] "
+        line += msg['content']
+        if msg.get("media_file"):
+            line += f" <{msg['media_file']}>"
+        line += "\n"
+        parent = msg.get("reply_to")
+        if parent:
+            quoted = parent["content"] or "[Message unavailable]"
+            if len(quoted) > QUOTE_LENGTH:
+                quoted = quoted[:QUOTE_LENGTH - 3] + "..."
+            quoted = quoted.replace("\n", " ")
+            line = f"    > {parent['sender'] or 'Unknown'}: {quoted}\n{line}"
+        for comment in msg.get("comments", ()):
+            line += f"    {self._format_txt_message(comment)}"
+        if msg.get("comments_error"):
+            line += f"    [Comments could not be fetched: {msg['comments_error']}]\n"
+        return line
+
+    def _trace_history_page(self, tracer, page_start, page_wait_us, page_size):
+        """Records one history page, timed by how long iter_messages kept us waiting for it."""
+        tracer.add_span("history_page", page_start, page_wait_us, messages=page_size)
+        tracer.count("history_pages")
+        if page_wait_us:
+            tracer.observe("messages_per_sec", page_size / (page_wait_us / 1_000_000))
 
     async def _async_logout(self):
         print("[LOG] Logging out...")
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self._close_service()
+        await self._close_downloader()
         if self.client and self.client.is_connected():
             await self.client.disconnect()
         self.client = None
@@ -208,7 +1517,7 @@ class TelegramExporterApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Telegram Chat Exporter")
-        self.setGeometry(100, 100, 450, 400)
+        self.setGeometry(100, 100, 450, 640)
 
         self.setStyleSheet("""
             QWidget {
@@ -363,6 +1672,27 @@ class TelegramExporterApp(QMainWindow):
         self.format_combo.addItems(["txt", "json"])
         layout.addWidget(self.format_combo)
 
+        self.trace_checkbox = QCheckBox("Write trace and metrics files")
+        layout.addWidget(self.trace_checkbox)
+
+        self.threads_checkbox = QCheckBox("Reconstruct reply threads")
+        layout.addWidget(self.threads_checkbox)
+
+        self.stats_checkbox = QCheckBox("Compute chat statistics")
+        layout.addWidget(self.stats_checkbox)
+
+        self.redact_checkbox = QCheckBox("Redact content")
+        layout.addWidget(self.redact_checkbox)
+
+        self.participants_checkbox = QCheckBox("Export participants (groups and channels)")
+        layout.addWidget(self.participants_checkbox)
+
+        self.media_checkbox = QCheckBox("Download media")
+        layout.addWidget(self.media_checkbox)
+
+        self.comments_checkbox = QCheckBox("Include channel post comments")
+        layout.addWidget(self.comments_checkbox)
+
         export_button = QPushButton("Export Chat")
         export_button.clicked.connect(self.start_export)
         layout.addWidget(export_button)
@@ -396,7 +1726,22 @@ class TelegramExporterApp(QMainWindow):
         if not all([target_user, output_file]):
             QMessageBox.critical(self, "Error", "Target username and output file are required.")
             return
-        self.worker._submit_async_task(self.worker._async_export(target_user, output_file, format_choice))
+        redaction_rules = None
+        if self.redact_checkbox.isChecked():
+            redaction_rules = self._load_config().get("redaction_rules", REDACTION_RULES_FILE)
+            if not os.path.exists(redaction_rules):
+                QMessageBox.critical(self, "Error", f"Redaction rules file '{redaction_rules}' not found.")
+                return
+        self.worker._submit_async_task(self.worker._async_export(
+            target_user, output_file, format_choice,
+            trace=self.trace_checkbox.isChecked(),
+            threads=self.threads_checkbox.isChecked(),
+            stats=self.stats_checkbox.isChecked(),
+            redaction_rules=redaction_rules,
+            participants=self.participants_checkbox.isChecked(),
+            download_media=self.media_checkbox.isChecked(),
+            comments=self.comments_checkbox.isChecked()
+        ))
 
     def logout(self):
         reply = QMessageBox.question(self, "Confirm Logout",
@@ -448,14 +1793,12 @@ class TelegramExporterApp(QMainWindow):
         self.stacked_widget.setCurrentWidget(self.exporter_page)
 
     def _save_config(self, api_id, api_hash):
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump({'api_id': api_id, 'api_hash': api_hash}, f)
+        config = load_config()
+        config.update({'api_id': api_id, 'api_hash': api_hash})
+        save_config(config)
 
     def _load_config(self):
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        return {}
+        return load_config()
 
     def closeEvent(self, event):
         """Handles the window closing event."""
@@ -465,6 +1808,16 @@ class TelegramExporterApp(QMainWindow):
         self.worker_thread.wait()
         event.accept()
 
+def load_config():
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_config(config):
+    with open(CONFIG_FILE, 'w') as f:
+        json.dump(config, f)
+
 def open_file(filepath):
     """Opens a file with the default system application."""
     try:
@@ -477,7 +1830,45 @@ def open_file(filepath):
     except Exception as e:
         QMessageBox.warning(None, "Warning", f"Could not open file automatically: {e}")
 
+def run_service():
+    """Runs the export service without a window until interrupted."""
+    app = QCoreApplication(sys.argv)
+    config = load_config()
+    if not config.get("service_socket"):
+        config.setdefault("service_port", SERVICE_PORT)
+
+    worker_thread = QThread()
+    worker = AsyncioWorker()
+    worker.moveToThread(worker_thread)
+    worker_thread.started.connect(worker.run)
+    worker.finished.connect(worker_thread.quit)
+    worker.show_login_frame.connect(lambda message: print(f"[ERROR] {message}"))
+    worker.show_login_frame.connect(app.quit)
+
+    def quit_without_service():
+        # The service not starting (e.g. the port is taken) leaves nothing to run in this mode.
+        if worker.service is None:
+            app.quit()
+    worker.show_exporter_frame.connect(quit_without_service)
+    worker_thread.start()
+    worker._submit_async_task(worker._async_check_login(config))
+
+    # Let Python handle Ctrl+C while the Qt event loop is running.
+    signal.signal(signal.SIGINT, lambda *args: app.quit())
+    timer = QTimer()
+    timer.timeout.connect(lambda: None)
+    timer.start(500)
+
+    exit_code = app.exec()
+    print("[LOG] Stopping export service...")
+    worker.stop()
+    worker_thread.quit()
+    worker_thread.wait()
+    return exit_code
+
 if __name__ == "__main__":
+    if "--service" in sys.argv:
+        sys.exit(run_service())
     app = QApplication(sys.argv)
     window = TelegramExporterApp()
     window.show()